@@ -1,11 +1,14 @@
-from flask import Flask, request, session, render_template_string, redirect, url_for
+from flask import Flask, request, session, redirect, url_for, g
 
+import hmac
 import os
 import secrets
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # Secure random secret key for session encryption
 
+FORM_MIMETYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+
 # CSRF Protection Middleware
 @app.before_request
 def csrf_protection():
@@ -15,38 +18,62 @@ def csrf_protection():
         if request.endpoint == 'login' or request.endpoint == 'login_form':
             return
         session_token = session.get('csrf_token')
-        request_token = request.form.get('csrf_token') or request.headers.get('X-CSRF-Token')
-        if not session_token or not request_token or not secrets.compare_digest(session_token, request_token):
+        # Check the header first so header-authenticated requests never parse the form body
+        request_token = request.headers.get('X-CSRF-Token')
+        if not request_token and request.mimetype in FORM_MIMETYPES:
+            request_token = request.form.get('csrf_token')
+        if not session_token or not request_token:
+            return "CSRF validation failed", 403
+        # Compare as bytes: str comparison raises TypeError on non-ASCII input
+        if not hmac.compare_digest(session_token.encode('ascii'), request_token.encode('utf-8')):
             return "CSRF validation failed", 403
 
 def generate_csrf_token():
-    """Generate and store cryptographically secure CSRF token"""
-    if 'csrf_token' not in session:
-        session['csrf_token'] = secrets.token_urlsafe(64)
-    return session['csrf_token']
+    """Generate and store cryptographically secure CSRF token, memoized per request"""
+    token = getattr(g, '_csrf', None)
+    if token is None:
+        token = session.get('csrf_token')
+        if token is None:
+            token = session['csrf_token'] = secrets.token_urlsafe(64)
+        g._csrf = token
+    return token
 
 # Inject CSRF token into all templates
 app.jinja_env.globals['csrf_token'] = generate_csrf_token
 
-# Secure Headers
+# Secure Headers, built once at import and applied to every response
+SECURITY_HEADERS = {
+    'Content-Security-Policy': "default-src 'self'",
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+}
+
 @app.after_request
 def set_security_headers(response):
-    response.headers['Content-Security-Policy'] = "default-src 'self'"
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
+    response.headers.update(SECURITY_HEADERS)
     return response
 
-# GET /login: Render login form
-@app.route('/login', methods=['GET'])
-def login_form():
-    html = '''
+# Templates are compiled once at import instead of on every request
+LOGIN_TEMPLATE = app.jinja_env.from_string('''
     <form method="POST" action="/login">
         <label>Username: <input type="text" name="username" required></label><br>
         <label>Password: <input type="password" name="password" required></label><br>
         <button type="submit">Login</button>
     </form>
-    '''
-    return render_template_string(html)
+    ''')
+
+EMAIL_TEMPLATE = app.jinja_env.from_string('''
+    <form method="POST" action="/update-email">
+        <input type="hidden" name="csrf_token" value="{{ csrf_token() }}">
+        <label>New Email: <input type="email" name="email" required></label>
+        <button type="submit">Update</button>
+    </form>
+    ''')
+
+# GET /login: Render login form
+@app.route('/login', methods=['GET'])
+def login_form():
+    return LOGIN_TEMPLATE.render()
 
 # POST /login: Handle login
 @app.route('/', methods=['POST'])
@@ -68,14 +95,7 @@ def valid_credentials(username, password):
 # GET /update-email: Render email update form
 @app.route('/update-email', methods=['GET'])
 def email_form():
-    html = '''
-    <form method="POST" action="/update-email">
-        <input type="hidden" name="csrf_token" value="{{ csrf_token() }}">
-        <label>New Email: <input type="email" name="email" required></label>
-        <button type="submit">Update</button>
-    </form>
-    '''
-    return render_template_string(html)
+    return EMAIL_TEMPLATE.render()
 
 # POST /update-email: Handle email update
 @app.route('/update-email', methods=['POST'])
@@ -84,8 +104,10 @@ def update_email():
         return redirect(url_for('login_form'))
     new_email = request.form.get('email')
     session.pop('csrf_token', None)  # Rotate CSRF token
+    g.pop('_csrf', None)
     return f"Email updated to {new_email}"
 
 if __name__ == '__main__':
-    # For local testing, you can use ssl_context='adhoc' for HTTPS
-    app.run(ssl_context='adhoc', port=5000)
+    # Set TLS_CERT/TLS_KEY to a pre-generated cert; 'adhoc' builds a new one on every start
+    ssl_context = (os.environ['TLS_CERT'], os.environ['TLS_KEY']) if 'TLS_CERT' in os.environ else 'adhoc'
+    app.run(ssl_context=ssl_context, port=5000)
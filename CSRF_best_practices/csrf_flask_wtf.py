@@ -1,4 +1,4 @@
-from flask import Flask, render_template_string, redirect, url_for, session
+from flask import Flask, redirect, url_for, session
 from flask_wtf import FlaskForm, CSRFProtect
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, Email
@@ -21,6 +21,24 @@ class EmailForm(FlaskForm):
     email = StringField('New Email', validators=[DataRequired(), Email()])
     submit = SubmitField('Update')
 
+# Templates are compiled once at import instead of on every request
+LOGIN_TEMPLATE = app.jinja_env.from_string('''
+    <form method="POST">
+        {{ form.hidden_tag() }}  <!-- CSRF token and other hidden fields -->
+        {{ form.username.label }} {{ form.username() }}<br>
+        {{ form.password.label }} {{ form.password() }}<br>
+        {{ form.submit() }}
+    </form>
+    ''')
+
+EMAIL_TEMPLATE = app.jinja_env.from_string('''
+    <form method="POST">
+        {{ form.hidden_tag() }}  <!-- CSRF token and other hidden fields -->
+        {{ form.email.label }} {{ form.email() }}<br>
+        {{ form.submit() }}
+    </form>
+    ''')
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     form = LoginForm()
@@ -34,14 +52,7 @@ def login():
         else:
             return "Invalid credentials", 401
     # Render login form with CSRF token included
-    return render_template_string('''
-    <form method="POST">
-        {{ form.hidden_tag() }}  <!-- CSRF token and other hidden fields -->
-        {{ form.username.label }} {{ form.username() }}<br>
-        {{ form.password.label }} {{ form.password() }}<br>
-        {{ form.submit() }}
-    </form>
-    ''', form=form)
+    return LOGIN_TEMPLATE.render(form=form)
 
 @app.route('/update-email', methods=['GET', 'POST'])
 def update_email():
@@ -53,13 +64,9 @@ def update_email():
         # Here you would update the email in your database
         return f"Email updated to {new_email}"
     # Render email update form with CSRF token included
-    return render_template_string('''
-    <form method="POST">
-        {{ form.hidden_tag() }}  <!-- CSRF token and other hidden fields -->
-        {{ form.email.label }} {{ form.email() }}<br>
-        {{ form.submit() }}
-    </form>
-    ''', form=form)
+    return EMAIL_TEMPLATE.render(form=form)
 
 if __name__ == '__main__':
-    app.run(ssl_context='adhoc', port=5000)
+    # Set TLS_CERT/TLS_KEY to a pre-generated cert; 'adhoc' builds a new one on every start
+    ssl_context = (os.environ['TLS_CERT'], os.environ['TLS_KEY']) if 'TLS_CERT' in os.environ else 'adhoc'
+    app.run(ssl_context=ssl_context, port=5000)
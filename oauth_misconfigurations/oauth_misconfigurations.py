@@ -1,8 +1,11 @@
 import secrets
 import hashlib
 import base64
+import functools
 import time
+import orjson  # Requires: pip install orjson
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Dict, Optional
 from jose import jwt, JWTError  # Requires: pip install python-jose
 
@@ -12,6 +15,12 @@ CLIENT_ID = "client123"
 CLIENT_SECRET = "supersecret"  # In production, store securely!
 REDIRECT_URI = "https://example.com/callback"
 JWKS_URL = f"{AUTH_SERVER}/.well-known/jwks.json"
+JWKS_TTL = 3600  # Seconds before cached signing keys are refetched
+JWKS_REFETCH_INTERVAL = 60  # Minimum seconds between early refetches triggered by an unknown kid
+INTROSPECT_WINDOW = 60  # Tokens this close to expiry are also checked via introspection
+
+# Process-wide JWKS cache shared by every OAuthClient, keys indexed by kid
+_JWKS_CACHE = {'jwks': None, 'keys_by_kid': {}, 'fetched_at': 0, 'expires_at': 0}
 
 class OAuthClient:
     """
@@ -20,26 +29,50 @@ class OAuthClient:
     def __init__(self, redirect_uri: str):
         # Store redirect URI for validation
         self.redirect_uri = redirect_uri
-        # Generate PKCE code verifier and challenge for this session
-        self.code_verifier, self.code_challenge = self.generate_pkce()
-        # Generate a cryptographically secure state parameter for CSRF protection
-        self.state = self.generate_state()
-        # Fetch JWKS (public keys) for JWT validation
-        self.jwks = self._fetch_jwks()
+        # Keep-alive session so repeated calls reuse TCP/TLS connections
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        # PKCE values, state, and JWKS are created lazily on first access (see properties below)
         # Token storage
         self.access_token = None
         self.refresh_token = None
         self.expires_at = 0
 
+    @functools.cached_property
+    def _pkce(self) -> (str, str):
+        # Generate PKCE code verifier and challenge for this session
+        return self.generate_pkce()
+
+    @property
+    def code_verifier(self) -> str:
+        return self._pkce[0]
+
+    @property
+    def code_challenge(self) -> str:
+        return self._pkce[1]
+
+    @functools.cached_property
+    def state(self) -> str:
+        # Generate a cryptographically secure state parameter for CSRF protection
+        return self.generate_state()
+
+    @property
+    def jwks(self) -> Dict:
+        # JWKS (public keys) for JWT validation, served from the shared cache
+        self._keys_by_kid()
+        return _JWKS_CACHE['jwks']
+
     def generate_pkce(self) -> (str, str):
         """
         Generate PKCE code verifier and corresponding challenge.
         """
-        code_verifier = secrets.token_urlsafe(64)  # High entropy string
+        # Built as bytes so the verifier can be hashed without re-encoding it
+        code_verifier = base64.urlsafe_b64encode(secrets.token_bytes(64)).rstrip(b'=')  # High entropy string
+        # RFC 7636: the challenge hashes the ASCII verifier, not the raw random bytes
         code_challenge = base64.urlsafe_b64encode(
-            hashlib.sha256(code_verifier.encode()).digest()
-        ).decode('utf-8').rstrip('=')
-        return code_verifier, code_challenge
+            hashlib.sha256(code_verifier).digest()
+        ).rstrip(b'=')
+        return code_verifier.decode('ascii'), code_challenge.decode('ascii')
 
     def generate_state(self) -> str:
         """
@@ -52,12 +85,32 @@ class OAuthClient:
         Fetch JWKS (JSON Web Key Set) for JWT signature validation.
         """
         try:
-            response = requests.get(JWKS_URL, timeout=5)
+            response = self._session.get(JWKS_URL, timeout=5)
             response.raise_for_status()
-            return response.json()
+            return orjson.loads(response.content)
         except Exception as e:
             raise Exception("Failed to fetch JWKS") from e
 
+    def _keys_by_kid(self, refresh: bool = False) -> Dict[str, Dict]:
+        """
+        Return JWKS keys indexed by kid from the process-wide cache, refetching after JWKS_TTL.
+        refresh=True refetches early (e.g. after key rotation). Fetch attempts, including failed
+        ones, happen at most once per JWKS_REFETCH_INTERVAL.
+        """
+        now = time.time()
+        due = refresh or now >= _JWKS_CACHE['expires_at']
+        if due and now - _JWKS_CACHE['fetched_at'] >= JWKS_REFETCH_INTERVAL:
+            # Record the attempt first so an unreachable server isn't retried on every call
+            _JWKS_CACHE['fetched_at'] = now
+            jwks = self._fetch_jwks()
+            # Build the new state fully, then publish it in one update
+            _JWKS_CACHE.update({
+                'jwks': jwks,
+                'keys_by_kid': {k['kid']: k for k in jwks['keys']},
+                'expires_at': now + JWKS_TTL,
+            })
+        return _JWKS_CACHE['keys_by_kid']
+
     def _store_tokens(self, token_response: Dict):
         """
         Securely store access and refresh tokens with expiration.
@@ -72,24 +125,31 @@ class OAuthClient:
         """
         Validate JWT locally and via token introspection endpoint.
         """
-        # First, validate JWT signature and claims locally
-        if not self._validate_jwt(token):
-            return False
+        return self.validate_token_local(token) and self.validate_token_remote(token)
+
+    def validate_token_local(self, token: str) -> bool:
+        """
+        Validate JWT signature and claims without contacting the authorization server.
+        """
+        return self._validate_jwt(token)
 
-        # Then, check token status with the authorization server
+    def validate_token_remote(self, token: str) -> bool:
+        """
+        Check token status with the authorization server's introspection endpoint.
+        """
         data = {
             'token': token,
             'client_id': CLIENT_ID,
             'client_secret': CLIENT_SECRET
         }
         try:
-            response = requests.post(
+            response = self._session.post(
                 f"{AUTH_SERVER}/introspect",
                 data=data,
                 timeout=5
             )
             response.raise_for_status()
-            return response.json().get('active', False)
+            return orjson.loads(response.content).get('active', False)
         except Exception as e:
             raise Exception("Token introspection failed") from e
 
@@ -102,7 +162,16 @@ class OAuthClient:
             header = jwt.get_unverified_header(token)
             kid = header['kid']
             # Find the matching public key in JWKS
-            key = next(k for k in self.jwks['keys'] if k['kid'] == kid)
+            try:
+                key = self._keys_by_kid().get(kid)
+                if key is None:
+                    # Unknown kid may mean the server rotated its keys; refetch once
+                    key = self._keys_by_kid(refresh=True).get(kid)
+            except Exception:
+                # Keys could not be fetched, so the token cannot be verified
+                return False
+            if key is None:
+                return False
             # Decode and validate the JWT
             claims = jwt.decode(
                 token,
@@ -113,7 +182,7 @@ class OAuthClient:
             )
             # Check expiration
             return claims['exp'] > time.time()
-        except (JWTError, KeyError, StopIteration):
+        except (JWTError, KeyError):
             return False
 
     def refresh_access_token(self) -> Optional[str]:
@@ -131,13 +200,13 @@ class OAuthClient:
         }
 
         try:
-            response = requests.post(
+            response = self._session.post(
                 f"{AUTH_SERVER}/token",
                 data=data,
                 timeout=5
             )
             response.raise_for_status()
-            self._store_tokens(response.json())
+            self._store_tokens(orjson.loads(response.content))
             return self.access_token
         except Exception as e:
             raise Exception("Token refresh failed") from e
@@ -152,16 +221,24 @@ class OAuthClient:
                 print("Token refresh failed or not available.")
                 return None
 
-        # Validate token before making request
-        if not self.validate_token(self.access_token):
+        # Validate token locally; only introspect when it is about to expire
+        if not self.validate_token_local(self.access_token):
+            print("Token is invalid or inactive.")
+            return None
+        if (self.expires_at - time.time() < INTROSPECT_WINDOW
+                and not self.validate_token_remote(self.access_token)):
             print("Token is invalid or inactive.")
             return None
 
         headers = {'Authorization': f'Bearer {self.access_token}'}
         try:
-            response = requests.get(url, headers=headers, timeout=5)
+            response = self._session.get(url, headers=headers, timeout=5)
+            # A 401 may mean the token was revoked, so confirm with introspection
+            if response.status_code == 401 and not self.validate_token_remote(self.access_token):
+                print("Token is invalid or inactive.")
+                return None
             response.raise_for_status()
-            return response.json()
+            return orjson.loads(response.content)
         except Exception as e:
             print("API request failed:", str(e))
             return None